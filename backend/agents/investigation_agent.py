@@ -1,22 +1,63 @@
-﻿from typing import Dict, List, Any, AsyncGenerator, Optional
+﻿from typing import Dict, List, Any, AsyncGenerator, Awaitable, Callable, Optional
 import asyncio
+import hashlib
 import uuid
-from datetime import datetime
 import json
+import logging
 import os
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
-from models.schemas import AgentNode, NodeType, InvestigationUpdate, InvestigationResult
+from models.schemas import AgentNode, NodeType
 from services.stock_data_service import StockDataService
-from services.claude_ai_service import ClaudeAIService
+from services.claude_ai_service import ClaudeAIService, get_claude_service
+from services.timestamps import iso_now
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Claude responses shared across agent instances, keyed on the call's inputs
+_claude_cache: TTLCache = TTLCache(maxsize=1024, ttl=900)
+_claude_cache_lock = asyncio.Lock()
+
+def _claude_cache_key(method: str, payload: Dict[str, Any]) -> str:
+    raw = json.dumps({"method": method, **payload}, sort_keys=True, default=str)
+    return hashlib.blake2b(raw.encode()).hexdigest()
+
+def _node_dict(node: AgentNode) -> Dict[str, Any]:
+    return {
+        "id": node.id,
+        "type": node.type.value,
+        "label": node.label,
+        "description": node.description,
+        "status": node.status,
+        "data": node.data,
+        "parent_id": node.parent_id,
+        "created_at": node.created_at,
+        "completed_at": node.completed_at
+    }
+
 class InvestigationState:
+    __slots__ = (
+        "investigation_id", "symbol", "nodes", "nodes_by_id", "node_dicts", "node_updates", "next_node_idx",
+        "current_findings", "next_actions", "confidence_score", "status",
+        "start_price", "end_price", "price_change_percent", "investigation_branches",
+        "cross_validation_nodes", "investigation_hypotheses", "planned_investigations",
+        "active_threads", "discovered_leads", "cross_validation_results", "claude_analysis", "changed"
+    )
+
     def __init__(self, investigation_id: str, symbol: str):
         self.investigation_id = investigation_id
         self.symbol = symbol
         self.nodes: List[AgentNode] = []
+        self.nodes_by_id: Dict[str, AgentNode] = {}
+        self.node_dicts: Dict[str, Dict[str, Any]] = {}
+        # Changes to already emitted nodes, in order, for streaming clients
+        self.node_updates: List[Dict[str, Any]] = []
+        self.next_node_idx = 0
         self.current_findings: List[str] = []
         self.next_actions: List[str] = []
         self.confidence_score: float = 0.0
@@ -33,32 +74,137 @@ class InvestigationState:
         self.active_threads: List[str] = []
         self.discovered_leads: List[str] = []
         self.cross_validation_results: Dict[str, bool] = {}
+        
+        # Combined Claude response shared by the decision, sentiment and inference nodes
+        self.claude_analysis: Dict[str, Any] = {}
+        
+        # Set, then replaced, whenever nodes, updates or status change; streamers await it
+        self.changed = asyncio.Event()
+
+    def notify_changed(self):
+        """Wake every streamer waiting on this investigation"""
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
 
 class InvestigationAgent:
+    # Longest a progress stream stays open, matching the frontend's investigation timeout
+    STREAM_TIMEOUT = 120.0
+    
     def __init__(self):
-        self.investigations: Dict[str, InvestigationState] = {}
-        self.openai_api_key = os.getenv("OPENAI_API_KEY")
+        # Finished investigations expire after an hour so memory stays bounded
+        self.investigations: TTLCache = TTLCache(maxsize=10000, ttl=3600)
+        self.openai_api_key = OPENAI_API_KEY
         self.stock_service = StockDataService()
         
+        self._claude_service: Optional[ClaudeAIService] = None
+        self._claude_unavailable = False
+
+    @property
+    def claude_service(self) -> Optional[ClaudeAIService]:
+        """Claude AI service, created on first use"""
+        if self._claude_service is None and not self._claude_unavailable:
+            try:
+                self._claude_service = get_claude_service()
+                logger.info("Claude AI service initialized")
+            except Exception as e:
+                logger.warning("Claude AI service not available: %s", e)
+                self._claude_unavailable = True
+        return self._claude_service
+
+    @property
+    def use_claude(self) -> bool:
+        return self.claude_service is not None
+
+    async def _cached_claude_call(self, method: str, payload: Dict[str, Any],
+                                  call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Return a memoized Claude result for identical inputs, calling Claude on a miss"""
+        key = _claude_cache_key(method, payload)
+        async with _claude_cache_lock:
+            cached = _claude_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        result = await call()
+        # Never memoize the service's fallback answers for transient API failures
+        if not result.get("fallback"):
+            async with _claude_cache_lock:
+                _claude_cache[key] = result
+        return result
+
+    def _new_node_id(self, state: InvestigationState) -> str:
+        """Node ids only need to be unique within their investigation"""
+        state.next_node_idx += 1
+        return f"{state.investigation_id}:{state.next_node_idx}"
+
+    def _emit_node(self, state: InvestigationState, node: AgentNode):
+        """Record a new node on the investigation and index it by id"""
+        state.nodes.append(node)
+        state.nodes_by_id[node.id] = node
+        state.node_dicts[node.id] = _node_dict(node)
+        state.notify_changed()
+
+    def _update_node(self, state: InvestigationState, node: AgentNode):
+        """Replace an emitted node with a newer version of itself"""
+        index = state.nodes.index(state.nodes_by_id[node.id])
+        state.nodes[index] = node
+        state.nodes_by_id[node.id] = node
+        state.node_dicts[node.id] = _node_dict(node)
+        state.node_updates.append({"type": "node_updated", "node": state.node_dicts[node.id]})
+        state.notify_changed()
+
+    def _get_news_data(self, state: InvestigationState) -> List[Dict[str, str]]:
+        """Simulated news headlines for the investigated symbol"""
+        return [
+            {"headline": f"{state.symbol} shows strong performance in latest quarter"},
+            {"headline": f"Analysts upgrade {state.symbol} price target"},
+            {"headline": f"{state.symbol} announces new product developments"}
+        ]
+
+    async def _run_combined_claude_analysis(self, state: InvestigationState):
+        """Fetch price, sentiment and inference analysis from Claude in one round-trip"""
+        if not (self.use_claude and self.claude_service):
+            return
+        
         try:
-            self.claude_service = ClaudeAIService()
-            self.use_claude = True
-            print("[SUCCESS] Claude AI service initialized")
+            price_change = state.price_change_percent or 0
+            stock_data = {
+                "price_change_percent": price_change,
+                "start_price": state.start_price or 95.0,
+                "current_price": state.end_price or 100,
+                "volume": 1000000
+            }
+            news_data = self._get_news_data(state)
+            
+            analysis = await self._cached_claude_call(
+                "analyze_full_investigation",
+                {"symbol": state.symbol, "price_change": round(price_change, 1), "news": news_data},
+                lambda: self.claude_service.analyze_full_investigation(state.symbol, stock_data, news_data)
+            )
+            if not analysis.get("fallback"):
+                state.claude_analysis = analysis
+                logger.info("Claude AI: combined analysis ready for %s", state.symbol)
+            
         except Exception as e:
-            print(f"[WARNING] Claude AI service not available: {e}")
-            self.claude_service = None
-            self.use_claude = False
+            logger.warning("Claude combined analysis error: %s", e)
 
     async def _fetch_comprehensive_price_data(self, state: InvestigationState) -> str:
         try:
-            stock_data = await self.stock_service.get_stock_quote(state.symbol)
-            historical_data = await self.stock_service.get_historical_data(state.symbol, 90)
-            
+            stock_data, historical_data = await asyncio.gather(
+                self.stock_service.get_stock_quote(state.symbol),
+                self.stock_service.get_historical_data(state.symbol, 90),
+                return_exceptions=True
+            )
+            if isinstance(stock_data, Exception):
+                raise stock_data
+            if isinstance(historical_data, Exception):
+                logger.warning("Error fetching historical data: %s", historical_data)
+                historical_data = []
+
             current_price = stock_data.get("current_price", 100.0)
             
             if historical_data and len(historical_data) > 0:
                 start_index = min(30, len(historical_data) - 1)
-                start_price = historical_data[-start_index].get("close", current_price)
+                start_price = historical_data[-start_index]["close"]
                 price_change = ((current_price - start_price) / start_price) * 100
                 
                 state.start_price = start_price
@@ -69,7 +215,8 @@ class InvestigationAgent:
                 state.end_price = current_price
                 state.price_change_percent = 5.26
             
-            node_id = str(uuid.uuid4())
+            node_id = self._new_node_id(state)
+            now = iso_now()
             node = AgentNode(
                 id=node_id,
                 type=NodeType.DATA_FETCH,
@@ -77,15 +224,16 @@ class InvestigationAgent:
                 description=f"Retrieved price data: {state.price_change_percent:+.2f}% change from  to ",
                 status="completed",
                 data={"symbol": state.symbol, "price_change_percent": state.price_change_percent},
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=now,
+                completed_at=now
             )
-            state.nodes.append(node)
+            self._emit_node(state, node)
             return node_id
             
         except Exception as e:
-            print(f"Error fetching price data: {e}")
-            node_id = str(uuid.uuid4())
+            logger.error("Error fetching price data: %s", e)
+            node_id = self._new_node_id(state)
+            now = iso_now()
             node = AgentNode(
                 id=node_id,
                 type=NodeType.DATA_FETCH,
@@ -93,10 +241,10 @@ class InvestigationAgent:
                 description="Demo data for testing",
                 status="completed",
                 data={"symbol": state.symbol, "demo": True},
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=now,
+                completed_at=now
             )
-            state.nodes.append(node)
+            self._emit_node(state, node)
             return node_id
 
     async def _analyze_price_movement_decision(self, state: InvestigationState, parent_node_id: str) -> str:
@@ -112,19 +260,24 @@ class InvestigationAgent:
                         "volume": 1000000
                     }
                     
-                    claude_analysis = await self.claude_service.analyze_price_movement(stock_data, state.symbol)
+                    claude_analysis = state.claude_analysis.get("price_analysis") or await self._cached_claude_call(
+                        "analyze_price_movement",
+                        {"symbol": state.symbol, "price_change": round(stock_data["price_change_percent"], 1)},
+                        lambda: self.claude_service.analyze_price_movement(stock_data, state.symbol)
+                    )
                     investigation_hypotheses = claude_analysis.get("investigation_hypotheses", [])
                     parallel_investigations = claude_analysis.get("parallel_investigations", [])
                     
-                    print(f"[SUCCESS] Claude AI: {len(investigation_hypotheses)} hypotheses for {state.symbol}")
+                    logger.info("Claude AI: %s hypotheses for %s", len(investigation_hypotheses), state.symbol)
                     
                 except Exception as e:
-                    print(f"Claude error: {e}")
+                    logger.warning("Claude error: %s", e)
                     investigation_hypotheses = ["Market analysis needed"]
             else:
                 investigation_hypotheses = ["Basic analysis"]
             
-            node_id = str(uuid.uuid4())
+            node_id = self._new_node_id(state)
+            now = iso_now()
             node = AgentNode(
                 id=node_id,
                 type=NodeType.DECISION,
@@ -133,31 +286,32 @@ class InvestigationAgent:
                 status="completed",
                 data={"investigation_hypotheses": investigation_hypotheses},
                 parent_id=parent_node_id,
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=now,
+                completed_at=now
             )
-            state.nodes.append(node)
+            self._emit_node(state, node)
             return node_id
             
         except Exception as e:
-            print(f"Error in decision analysis: {e}")
+            logger.error("Error in decision analysis: %s", e)
             return parent_node_id
 
     async def _spawn_sub_investigations(self, state: InvestigationState, parent_node_id: str):
         """Spawn sub-investigation nodes based on Claude's analysis"""
         try:
             # Get the decision data to determine what sub-investigations to spawn
-            parent_node = next((node for node in state.nodes if node.id == parent_node_id), None)
+            parent_node = state.nodes_by_id.get(parent_node_id)
             if not parent_node or not parent_node.data:
                 return
             
             hypotheses = parent_node.data.get("investigation_hypotheses", [])
+            hypotheses_text = " ".join(h.lower() for h in hypotheses)
             
             # Create sentiment analysis node for news
             sentiment_node_id = await self._create_sentiment_analysis_node(state, parent_node_id)
             
             # Create earnings investigation node if relevant
-            if any("earnings" in h.lower() for h in hypotheses):
+            if "earnings" in hypotheses_text:
                 earnings_node_id = await self._create_earnings_investigation_node(state, parent_node_id)
             
             # Create market context analysis node
@@ -167,7 +321,7 @@ class InvestigationAgent:
             technical_node_id = await self._create_technical_analysis_node(state, parent_node_id)
             
         except Exception as e:
-            print(f"Error spawning sub-investigations: {e}")
+            logger.error("Error spawning sub-investigations: %s", e)
 
     async def _create_sentiment_analysis_node(self, state: InvestigationState, parent_node_id: str) -> str:
         """Create sentiment analysis child node"""
@@ -176,13 +330,12 @@ class InvestigationAgent:
             if self.use_claude and self.claude_service:
                 try:
                     # Use Claude for news sentiment analysis
-                    news_data = [
-                        {"headline": f"{state.symbol} shows strong performance in latest quarter"},
-                        {"headline": f"Analysts upgrade {state.symbol} price target"},
-                        {"headline": f"{state.symbol} announces new product developments"}
-                    ]
-                    sentiment_result = await self.claude_service.analyze_news_sentiment(
-                        state.symbol, news_data, state.price_change_percent or 0
+                    news_data = self._get_news_data(state)
+                    price_change = state.price_change_percent or 0
+                    sentiment_result = state.claude_analysis.get("sentiment") or await self._cached_claude_call(
+                        "analyze_news_sentiment",
+                        {"symbol": state.symbol, "price_change": round(price_change, 1), "news": news_data},
+                        lambda: self.claude_service.analyze_news_sentiment(state.symbol, news_data, price_change)
                     )
                     sentiment_summary = sentiment_result.get("overall_sentiment", "neutral")
                     impact_score = sentiment_result.get("sentiment_score", 0.5)
@@ -193,7 +346,8 @@ class InvestigationAgent:
                 sentiment_summary = "positive" if (state.price_change_percent or 0) > 0 else "negative"
                 impact_score = 0.7
             
-            node_id = str(uuid.uuid4())
+            node_id = self._new_node_id(state)
+            now = iso_now()
             node = AgentNode(
                 id=node_id,
                 type=NodeType.ANALYSIS,
@@ -206,21 +360,22 @@ class InvestigationAgent:
                     "analysis_type": "news_sentiment"
                 },
                 parent_id=parent_node_id,
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=now,
+                completed_at=now
             )
-            state.nodes.append(node)
+            self._emit_node(state, node)
             state.investigation_branches.append("sentiment_analysis")
             return node_id
             
         except Exception as e:
-            print(f"Error creating sentiment analysis node: {e}")
+            logger.error("Error creating sentiment analysis node: %s", e)
             return ""
 
     async def _create_earnings_investigation_node(self, state: InvestigationState, parent_node_id: str) -> str:
         """Create earnings investigation child node"""
         try:
-            node_id = str(uuid.uuid4())
+            node_id = self._new_node_id(state)
+            now = iso_now()
             node = AgentNode(
                 id=node_id,
                 type=NodeType.DECISION,
@@ -233,21 +388,22 @@ class InvestigationAgent:
                     "analysis_focus": "EPS and guidance"
                 },
                 parent_id=parent_node_id,
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=now,
+                completed_at=now
             )
-            state.nodes.append(node)
+            self._emit_node(state, node)
             state.investigation_branches.append("earnings_investigation")
             return node_id
             
         except Exception as e:
-            print(f"Error creating earnings investigation node: {e}")
+            logger.error("Error creating earnings investigation node: %s", e)
             return ""
 
     async def _create_market_context_node(self, state: InvestigationState, parent_node_id: str) -> str:
         """Create market context analysis child node"""
         try:
-            node_id = str(uuid.uuid4())
+            node_id = self._new_node_id(state)
+            now = iso_now()
             node = AgentNode(
                 id=node_id,
                 type=NodeType.ANALYSIS,
@@ -260,21 +416,22 @@ class InvestigationAgent:
                     "analysis_type": "market_context"
                 },
                 parent_id=parent_node_id,
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=now,
+                completed_at=now
             )
-            state.nodes.append(node)
+            self._emit_node(state, node)
             state.investigation_branches.append("market_context")
             return node_id
             
         except Exception as e:
-            print(f"Error creating market context node: {e}")
+            logger.error("Error creating market context node: %s", e)
             return ""
 
     async def _create_technical_analysis_node(self, state: InvestigationState, parent_node_id: str) -> str:
         """Create technical analysis child node"""
         try:
-            node_id = str(uuid.uuid4())
+            node_id = self._new_node_id(state)
+            now = iso_now()
             node = AgentNode(
                 id=node_id,
                 type=NodeType.ANALYSIS,
@@ -288,15 +445,15 @@ class InvestigationAgent:
                     "analysis_type": "technical"
                 },
                 parent_id=parent_node_id,
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=now,
+                completed_at=now
             )
-            state.nodes.append(node)
+            self._emit_node(state, node)
             state.investigation_branches.append("technical_analysis")
             return node_id
             
         except Exception as e:
-            print(f"Error creating technical analysis node: {e}")
+            logger.error("Error creating technical analysis node: %s", e)
             return ""
 
     async def _cross_validate_findings(self, state: InvestigationState):
@@ -307,11 +464,12 @@ class InvestigationAgent:
             
             if len(analysis_nodes) >= 2:
                 # Create cross-validation node that connects separate analyses
-                node_id = str(uuid.uuid4())
+                node_id = self._new_node_id(state)
                 
                 # Connect sentiment and technical analysis
                 connected_nodes = analysis_nodes[:2]
                 
+                now = iso_now()
                 node = AgentNode(
                     id=node_id,
                     type=NodeType.VALIDATION,
@@ -325,19 +483,41 @@ class InvestigationAgent:
                         "validation_result": "aligned"
                     },
                     parent_id=connected_nodes[0].id,  # Connect to first analysis node
-                    created_at=datetime.now().isoformat(),
-                    completed_at=datetime.now().isoformat()
+                    created_at=now,
+                    completed_at=now
                 )
-                state.nodes.append(node)
+                self._emit_node(state, node)
                 state.cross_validation_nodes.append(node_id)
                 
-                print(f"[SUCCESS] Cross-validation created connecting {len(connected_nodes)} analysis nodes")
+                logger.info("Cross-validation created connecting %s analysis nodes", len(connected_nodes))
             
         except Exception as e:
-            print(f"Error in cross-validation: {e}")
+            logger.error("Error in cross-validation: %s", e)
+
+    async def _stream_master_inference(self, state: InvestigationState, node_id: str, parent_node_id: str,
+                                       all_evidence: List[str], price_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Emit an in-progress inference node that fills in as Claude streams its answer"""
+        node = AgentNode(
+            id=node_id,
+            type=NodeType.INFERENCE,
+            label=f"Master Inference: {state.symbol}",
+            description="Generating master inference...",
+            status="in_progress",
+            data={"streamed_text": ""},
+            parent_id=parent_node_id,
+            created_at=iso_now()
+        )
+        self._emit_node(state, node)
+        
+        def on_text(text: str):
+            state.node_updates.append({"type": "node_update_partial", "id": node_id, "delta": text})
+            state.notify_changed()
+        
+        return await self.claude_service.stream_master_inference(state.symbol, all_evidence, price_data, {}, on_text)
 
     async def _create_master_inference(self, state: InvestigationState, validation_node_id: str, inference_nodes: List[str]) -> str:
         try:
+            node_id = self._new_node_id(state)
             all_evidence = []
             for node in state.nodes:
                 if node.status == "completed" and node.data:
@@ -357,8 +537,10 @@ class InvestigationAgent:
                         "magnitude": magnitude
                     }
                     
-                    claude_analysis = await self.claude_service.generate_master_inference(
-                        state.symbol, all_evidence, price_data, {}
+                    claude_analysis = state.claude_analysis.get("master_inference") or await self._cached_claude_call(
+                        "generate_master_inference",
+                        {"symbol": state.symbol, "price_change": round(price_change, 1), "evidence": sorted(all_evidence)},
+                        lambda: self._stream_master_inference(state, node_id, validation_node_id, all_evidence, price_data)
                     )
                     
                     executive_summary = claude_analysis.get("executive_summary", f"{state.symbol} moved {price_change:.1f}%")
@@ -367,7 +549,7 @@ class InvestigationAgent:
                     cause_confidence = claude_analysis.get("cause_confidence", 0.8)
                     
                 except Exception as e:
-                    print(f"Claude inference error: {e}")
+                    logger.warning("Claude inference error: %s", e)
                     executive_summary = f"{state.symbol}: {direction} {magnitude:.1f}%"
                     primary_cause = "Analysis Required"
                     detailed_explanation = f"Price moved {magnitude:.1f}% {direction}."
@@ -378,7 +560,8 @@ class InvestigationAgent:
                 detailed_explanation = f"Stock {direction} by {magnitude:.1f}%."
                 cause_confidence = 0.6
             
-            node_id = str(uuid.uuid4())
+            now = iso_now()
+            streamed_node = state.nodes_by_id.get(node_id)
             node = AgentNode(
                 id=node_id,
                 type=NodeType.INFERENCE,
@@ -392,16 +575,19 @@ class InvestigationAgent:
                     "cause_confidence": cause_confidence
                 },
                 parent_id=validation_node_id,
-                created_at=datetime.now().isoformat(),
-                completed_at=datetime.now().isoformat()
+                created_at=streamed_node.created_at if streamed_node else now,
+                completed_at=now
             )
             
-            state.nodes.append(node)
+            if streamed_node:
+                self._update_node(state, node)
+            else:
+                self._emit_node(state, node)
             state.confidence_score = cause_confidence
             return node_id
             
         except Exception as e:
-            print(f"Error creating master inference: {e}")
+            logger.error("Error creating master inference: %s", e)
             return validation_node_id or ""
 
     async def _run_investigation_immediately(self, investigation_id: str):
@@ -409,10 +595,11 @@ class InvestigationAgent:
         state = self.investigations[investigation_id]
         
         try:
-            print(f"[INFO] Starting comprehensive investigation for {state.symbol}")
+            logger.info("Starting comprehensive investigation for %s", state.symbol)
             
             # Phase 1: Data Fetch - Creates main data node
             price_data_node = await self._fetch_comprehensive_price_data(state)
+            await self._run_combined_claude_analysis(state)
             await asyncio.sleep(0.3)
             
             # Phase 2: Initial Analysis - Creates decision node 
@@ -432,11 +619,13 @@ class InvestigationAgent:
             await asyncio.sleep(0.3)
             
             state.status = "completed"
-            print(f"[SUCCESS] Comprehensive investigation completed for {state.symbol}")
+            state.notify_changed()
+            logger.info("Comprehensive investigation completed for %s", state.symbol)
             
         except Exception as e:
-            print(f"Investigation error: {e}")
+            logger.error("Investigation error: %s", e)
             state.status = "error"
+            state.notify_changed()
 
     async def start_investigation(self, symbol: str, date_range=None) -> str:
         investigation_id = str(uuid.uuid4())
@@ -457,20 +646,7 @@ class InvestigationAgent:
             "symbol": state.symbol,
             "status": state.status,
             "confidence_score": state.confidence_score,
-            "nodes": [
-                {
-                    "id": node.id,
-                    "type": node.type.value,
-                    "label": node.label,
-                    "description": node.description,
-                    "status": node.status,
-                    "data": node.data,
-                    "parent_id": node.parent_id,
-                    "created_at": node.created_at,
-                    "completed_at": node.completed_at
-                }
-                for node in state.nodes
-            ],
+            "nodes": [state.node_dicts[node.id] for node in state.nodes],
             "current_findings": state.current_findings,
             "investigation_branches": state.investigation_branches
         }
@@ -482,10 +658,16 @@ class InvestigationAgent:
         
         state = self.investigations[investigation_id]
         last_node_count = 0
-        max_iterations = 50
-        iterations = 0
+        last_update_count = 0
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.STREAM_TIMEOUT
+        timed_out = False
         
-        while state.status == "active" and iterations < max_iterations:
+        while True:
+            # Read before draining, so a change made while we yield is either drained
+            # by this pass or wakes the wait below
+            changed = state.changed
+            status = state.status
             current_node_count = len(state.nodes)
             
             if current_node_count > last_node_count:
@@ -493,28 +675,28 @@ class InvestigationAgent:
                     node = state.nodes[i]
                     yield {
                         "type": "node_update",
-                        "node": {
-                            "id": node.id,
-                            "type": node.type.value,
-                            "label": node.label,
-                            "description": node.description,
-                            "status": node.status,
-                            "data": node.data,
-                            "parent_id": node.parent_id,
-                            "created_at": node.created_at,
-                            "completed_at": node.completed_at
-                        },
-                        "timestamp": datetime.now().isoformat()
+                        "node": state.node_dicts[node.id],
+                        "timestamp": iso_now()
                     }
                 last_node_count = current_node_count
             
-            iterations += 1
-            await asyncio.sleep(0.1)
+            current_update_count = len(state.node_updates)
+            for i in range(last_update_count, current_update_count):
+                yield state.node_updates[i]
+            last_update_count = current_update_count
+            
+            if status != "active" or timed_out:
+                break
+            try:
+                await asyncio.wait_for(changed.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                # Drain once more, then report the investigation as it stands
+                timed_out = True
         
         yield {
             "type": "investigation_complete",
             "status": state.status,
             "confidence_score": state.confidence_score,
             "total_nodes": len(state.nodes),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": iso_now()
         }
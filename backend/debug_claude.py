@@ -1,8 +1,11 @@
 import asyncio
 from services.claude_ai_service import ClaudeAIService
-import json
+import orjson
 import re
 
+# Control characters other than tab, newline and carriage return
+_CTRL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
 async def debug_claude():
     try:
         service = ClaudeAIService()
@@ -16,7 +19,7 @@ Respond with valid JSON only:
   "detailed_reasoning": "explanation"
 }"""
 
-        response = service.client.messages.create(
+        response = await service.client.messages.create(
             model=service.model,
             max_tokens=800,
             temperature=0.2,
@@ -29,10 +32,7 @@ Respond with valid JSON only:
         print(repr(content))
         
         # Look for problematic characters
-        problematic_chars = []
-        for i, char in enumerate(content):
-            if ord(char) < 32 and char not in '\n\t\r':
-                problematic_chars.append((i, char, ord(char)))
+        problematic_chars = [(m.start(), m.group(), ord(m.group())) for m in _CTRL_RE.finditer(content)]
         
         if problematic_chars:
             print('\nFound problematic characters:')
@@ -43,10 +43,10 @@ Respond with valid JSON only:
             
         # Try parsing as-is
         try:
-            result = json.loads(content)
+            result = orjson.loads(content)
             print('\nDirect JSON parsing successful!')
             print('Result:', result)
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             print(f'\nDirect JSON parsing failed: {e}')
             if hasattr(e, 'pos'):
                 error_pos = e.pos
@@ -1,23 +1,49 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import json
+from typing import Dict, Any, Optional
 import asyncio
-from datetime import datetime
-import yfinance as yf
+import functools
+import orjson
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 # Import our LangGraph agent
 from agents.investigation_agent import InvestigationAgent
 from models.schemas import StockInvestigationRequest, InvestigationResponse, AgentNode
 from services.stock_data_service import StockDataService
+from services.timestamps import iso_now, utc_now
+
+# Handlers only enqueue records; a listener thread does the blocking write to stderr
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), handlers=[QueueHandler(_log_queue)])
+_log_listener.start()
+
+logger = logging.getLogger("api")
+
+def fastapi_safe(endpoint):
+    """Log unexpected endpoint errors and turn them into HTTP 500 responses"""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception("Error in %s", endpoint.__name__)
+            raise HTTPException(status_code=500, detail=str(e))
+    return wrapper
 
 app = FastAPI(title="Agentic AI Stock Investigation System", version="1.0.0")
 
 # Initialize a single global agent instance
 agent = InvestigationAgent()
-stock_service = StockDataService()
+# Share the agent's service so the API and investigations use one HTTP connection pool
+stock_service: StockDataService = agent.stock_service
 
 # CORS middleware
 app.add_middleware(
@@ -30,32 +56,105 @@ app.add_middleware(
 
 # Global WebSocket connections manager
 class ConnectionManager:
+    SEND_TIMEOUT = 5.0
+    QUEUE_SIZE = 256
+    MAX_BATCH = 32
+    COALESCE_WINDOW = 0.02
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # Each client gets a queue of serialized messages drained by its own writer task
+        self.active_connections: Dict[WebSocket, asyncio.Queue] = {}
+        self._writers: Dict[WebSocket, asyncio.Task] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self.active_connections[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self.active_connections.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+
+    def _enqueue(self, websocket: WebSocket, message: str):
+        queue = self.active_connections.get(websocket)
+        if queue is None:
+            return
+        if queue.full():
+            # Slow client: drop its oldest message rather than blocking the producer
+            queue.get_nowait()
+            queue.task_done()
+        queue.put_nowait(message)
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        self._enqueue(websocket, message)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        # Snapshot so a concurrent disconnect cannot change the dict mid-iteration
+        for websocket in tuple(self.active_connections):
+            self._enqueue(websocket, message)
+
+    async def broadcast_json(self, obj: Any):
+        """Serialize once and share the same text across every client"""
+        await self.broadcast(orjson.dumps(obj).decode())
+
+    async def flush(self, websocket: WebSocket):
+        """Wait until every message queued for a client has been sent"""
+        queue = self.active_connections.get(websocket)
+        if queue is not None:
+            await queue.join()
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued messages, merging those that arrive within the coalescing window into one JSON array frame"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                messages = [await queue.get()]
+                try:
+                    deadline = loop.time() + self.COALESCE_WINDOW
+                    while len(messages) < self.MAX_BATCH:
+                        if not queue.empty():
+                            messages.append(queue.get_nowait())
+                            continue
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            messages.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+                        except asyncio.TimeoutError:
+                            break
+                    await asyncio.wait_for(
+                        websocket.send_text("[" + ",".join(messages) + "]"),
+                        timeout=self.SEND_TIMEOUT
+                    )
+                finally:
+                    for _ in messages:
+                        queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(websocket)
+            # Release anyone waiting in flush()
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
 
 manager = ConnectionManager()
 
+@app.on_event("shutdown")
+async def shutdown():
+    await stock_service.aclose()
+    _log_listener.stop()
+
 @app.get("/")
 async def root():
     return {"message": "Agentic AI Stock Investigation System API"}
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {"status": "healthy", "timestamp": iso_now()}
 
 @app.post("/api/validate-stock", response_model=Dict[str, Any])
 async def validate_stock_data(request: StockInvestigationRequest):
@@ -76,11 +175,12 @@ async def validate_stock_data(request: StockInvestigationRequest):
             "market_cap": stock_data.get("market_cap"),
             "company_name": f"{symbol} Corporation",  # We'll enhance this later
             "sector": "Technology",  # Default for demo
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": iso_now(),
             "data_source": stock_data.get("source", "unknown")
         }
         
     except Exception as e:
+        logger.warning("Stock validation failed for %s: %s", request.symbol, e)
         # Return basic response for demo purposes
         return {
             "symbol": request.symbol.upper(),
@@ -92,64 +192,72 @@ async def validate_stock_data(request: StockInvestigationRequest):
             "market_cap": 100000000,
             "company_name": f"{request.symbol} Company",
             "sector": "Demo",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": iso_now(),
             "data_source": "fallback",
             "error": str(e)
         }
 
 @app.post("/api/investigate", response_model=InvestigationResponse)
+@fastapi_safe
 async def start_investigation(request: StockInvestigationRequest):
     """Start autonomous AI investigation of a stock"""
-    try:
-        print(f"Starting investigation for {request.symbol}")
-        
-        # Use the global agent instance
-        investigation_id = await agent.start_investigation(request.symbol, request.date_range)
-        print(f"Investigation started with ID: {investigation_id}")
-        
-        return InvestigationResponse(
-            investigation_id=investigation_id,
-            status="started",
-            message=f"Investigation started for {request.symbol}",
-            timestamp=datetime.now().isoformat()
-        )
-    except Exception as e:
-        print(f"Error starting investigation: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    logger.info("Starting investigation for %s", request.symbol)
+    
+    # Use the global agent instance
+    investigation_id = await agent.start_investigation(request.symbol, request.date_range)
+    logger.info("Investigation started with ID: %s", investigation_id)
+    
+    return InvestigationResponse(
+        investigation_id=investigation_id,
+        status="started",
+        message=f"Investigation started for {request.symbol}",
+        timestamp=utc_now()
+    )
 
 @app.get("/api/investigation/{investigation_id}")
+@fastapi_safe
 async def get_investigation_status(investigation_id: str):
     """Get the current status and results of an investigation"""
-    try:
-        # Use the global agent instance
-        status = await agent.get_investigation_status(investigation_id)
-        return status
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Use the global agent instance
+    status = await agent.get_investigation_status(investigation_id)
+    return ORJSONResponse(status)
 
 @app.websocket("/ws/investigation/{investigation_id}")
 async def websocket_investigation_stream(websocket: WebSocket, investigation_id: str):
     """WebSocket endpoint for real-time investigation updates"""
     await manager.connect(websocket)
-    print(f"WebSocket connected for investigation: {investigation_id}")
+    logger.info("WebSocket connected for investigation: %s", investigation_id)
     
     try:
         # Use the global agent instance
         async for update in agent.stream_investigation_progress(investigation_id):
-            print(f"Sending update: {update.get('type')}")
-            await websocket.send_text(json.dumps(update))
+            if websocket not in manager.active_connections:
+                logger.info("WebSocket disconnected for investigation: %s", investigation_id)
+                break
+            logger.debug("Sending update: %s", update.get('type'))
+            await manager.send_personal_message(orjson.dumps(update).decode(), websocket)
+        await manager.flush(websocket)
             
-    except WebSocketDisconnect:
-        print(f"WebSocket disconnected for investigation: {investigation_id}")
-        manager.disconnect(websocket)
     except Exception as e:
-        print(f"WebSocket error for investigation {investigation_id}: {str(e)}")
-        await websocket.send_text(json.dumps({
+        logger.exception("WebSocket error for investigation %s", investigation_id)
+        await manager.send_personal_message(orjson.dumps({
             "type": "error",
             "message": str(e),
-            "timestamp": datetime.now().isoformat()
-        }))
+            "timestamp": iso_now()
+        }).decode(), websocket)
+        await manager.flush(websocket)
+    finally:
+        manager.disconnect(websocket)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001, reload=False)
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8001,
+        reload=False,
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        workers=1
+    )
\ No newline at end of file
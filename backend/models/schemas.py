@@ -1,21 +1,27 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from enum import Enum
 
 class DateRange(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     start_date: str
     end_date: str
 
 class StockInvestigationRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     symbol: str
     date_range: Optional[DateRange] = None
 
 class InvestigationResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     investigation_id: str
     status: str
     message: str
-    timestamp: str
+    timestamp: datetime
 
 class NodeType(str, Enum):
     DATA_FETCH = "data_fetch"
@@ -26,6 +32,9 @@ class NodeType(str, Enum):
     SPAWN = "spawn"
 
 class AgentNode(BaseModel):
+    # Nodes are replaced, never mutated, once emitted
+    model_config = ConfigDict(frozen=True)
+
     id: str
     type: NodeType
     label: str
@@ -33,18 +42,22 @@ class AgentNode(BaseModel):
     status: str  # "pending", "in_progress", "completed", "error"
     data: Dict[str, Any]
     parent_id: Optional[str] = None
-    children_ids: List[str] = []
+    children_ids: List[str] = Field(default_factory=list)
     created_at: str
     completed_at: Optional[str] = None
 
 class InvestigationUpdate(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     type: str  # "node_created", "node_updated", "node_completed", "investigation_complete"
     investigation_id: str
     node: Optional[AgentNode] = None
     message: str
-    timestamp: str
-    
+    timestamp: datetime
+
 class InvestigationResult(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     investigation_id: str
     symbol: str
     status: str
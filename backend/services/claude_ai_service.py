@@ -1,64 +1,426 @@
 import os
-import json
+import asyncio
+import hashlib
+import logging
+import orjson
 import re
-from typing import Dict, List, Any, Optional
-from anthropic import Anthropic
+from functools import lru_cache
+from typing import Callable, Dict, List, Any, Optional, Union
+import httpx
+from anthropic import AsyncAnthropic
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Caps concurrent Claude requests across all investigations in this process
+CLAUDE_SEM = asyncio.Semaphore(int(os.getenv("CLAUDE_MAX_CONCURRENCY", "8")))
+
+# Control characters except newlines and tabs
+_CTRL_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+
+# JSON inside markdown code blocks, tried in order
+_JSON_PATTERNS = [re.compile(p, re.DOTALL) for p in (
+    r'```json\s*(\{.*?\})\s*```',
+    r'```\s*(\{.*?\})\s*```'
+)]
+
+# Last-resort extraction of individual master inference fields
+_KEY_PATTERNS = [(key, re.compile(p)) for key, p in (
+    ("executive_summary", r'"executive_summary":\s*"([^"]*)"'),
+    ("primary_cause", r'"primary_cause":\s*"([^"]*)"'),
+    ("detailed_reasoning", r'"detailed_reasoning":\s*"([^"]*)"'),
+    ("confidence_score", r'"confidence_score":\s*([0-9.]+)'),
+    ("cause_confidence", r'"cause_confidence":\s*([0-9.]+)')
+)]
+
+class _JsonObjectScanner:
+    """Incremental brace counter that detects when the first top-level {...} object closes"""
+    
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, text: str) -> int:
+        """Consume text; return the index just past the closing brace, or -1 if still open"""
+        for i, char in enumerate(text):
+            if not self.started:
+                if char != '{':
+                    continue
+                self.started = True
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
+
+def _extract_json_span(text: str, start: int = 0) -> Optional[str]:
+    """Return the first balanced {...} object at or after start, skipping braces inside strings"""
+    begin = text.find('{', start)
+    if begin == -1:
+        return None
+    
+    end = _JsonObjectScanner().feed(text[begin:])
+    return text[begin:begin + end] if end != -1 else None
+
+# Prompt-caching beta: content blocks marked with cache_control are reused as a cached prefix
+_PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+_NEWS_SENTIMENT_INSTRUCTIONS = """As a financial news analyst, analyze how the news headlines below relate to the stock's price movement.
+
+Provide analysis in JSON format:
+{
+    "overall_sentiment": "positive|negative|neutral",
+    "sentiment_score": 0.0-1.0,
+    "news_contribution_percent": 0-100,
+    "key_themes": ["theme1", "theme2"],
+    "market_impact_assessment": "detailed explanation",
+    "confidence": 0.0-1.0
+}"""
+
+_MASTER_INFERENCE_INSTRUCTIONS = """Analyze why a stock moved using the investigation findings and price data below.
+
+Respond with ONLY valid JSON in this exact format:
+{
+    "executive_summary": "Brief 1-2 sentence explanation",
+    "primary_cause": "Main driver category", 
+    "detailed_reasoning": "Comprehensive explanation of why this price movement occurred",
+    "key_catalysts": ["catalyst1", "catalyst2"],
+    "confidence_score": 0.8,
+    "cause_confidence": 0.8,
+    "movement_sustainability": "moderate",
+    "investment_thesis": "Investment implication"
+}
+
+IMPORTANT: Response must be valid JSON only. No markdown, no explanatory text, just the JSON object."""
+
+# Per-call prompt templates, filled with str.format
+_NEWS_SENTIMENT_DATA = """STOCK: {symbol}
+
+HEADLINES:
+{headlines}
+
+PRICE MOVEMENT: {price_change:.2f}%"""
+
+_MASTER_INFERENCE_DATA = """INVESTIGATION FINDINGS:
+{findings}
+
+DATA: {data}"""
+
+_MASTER_INFERENCE_QUESTION = "Analyze why {symbol} moved {price_change:.2f}% from ${start_price:.2f} to ${end_price:.2f}."
+
+_PRICE_MOVEMENT_PROMPT = """You are a professional stock market analyst. Analyze the following stock data and provide intelligent investigation strategy:
+
+STOCK: {symbol}
+PRICE CHANGE: {price_change:.2f}%
+CURRENT PRICE: ${current_price:.2f}
+VOLUME: {volume:,}
+
+Based on this price movement, determine:
+1. What investigation hypotheses should be explored?
+2. What parallel investigation threads should be spawned?
+3. How significant is this price movement?
+4. What's the most likely cause category?
+
+Respond in JSON format:
+{{
+    "investigation_hypotheses": ["hypothesis1", "hypothesis2", ...],
+    "parallel_investigations": ["thread1", "thread2", ...],
+    "significance": "high|moderate|low",
+    "primary_cause_category": "earnings|news|market|technical",
+    "confidence": 0.8,
+    "reasoning": "Brief explanation of your analysis"
+}}"""
+
+_EARNINGS_IMPACT_PROMPT = """As a financial analyst, analyze how {symbol}'s earnings performance relates to its {price_change:.2f}% price movement:
+
+EARNINGS DATA:
+- EPS: ${eps:.2f} (Expected: ${expected_eps:.2f})
+- Revenue Growth: {revenue_growth:.1f}%
+- Beat Expectations: {beat_estimate}
+- Guidance Updated: {guidance_updated}
+
+PRICE MOVEMENT: {price_change:.2f}%
+
+Analyze in JSON format:
+{{
+    "earnings_explanation": "detailed analysis of earnings impact",
+    "surprise_factor": 0.0-1.0,
+    "earnings_contribution_percent": 0-100,
+    "forward_guidance_impact": "positive|negative|neutral",
+    "market_reaction_appropriateness": "overreaction|appropriate|underreaction",
+    "confidence": 0.0-1.0
+}}"""
+
+_FULL_INVESTIGATION_PROMPT = """You are a professional stock market analyst investigating {symbol}'s {price_change:.2f}% price movement.
+
+STOCK: {symbol}
+PRICE CHANGE: {price_change:.2f}% (from ${start_price:.2f} to ${current_price:.2f})
+VOLUME: {volume:,}
+
+HEADLINES:
+{headlines}
+
+Complete all three tasks:
+1. price_analysis: Which investigation hypotheses and parallel threads should be explored, how significant is the move and what is the most likely cause category?
+2. sentiment: How do the headlines relate to the price movement?
+3. master_inference: Explain WHY the price moved, combining the price and news evidence.
+
+Respond with ONLY valid JSON in this exact format:
+{{
+    "price_analysis": {{
+        "investigation_hypotheses": ["hypothesis1", "hypothesis2"],
+        "parallel_investigations": ["thread1", "thread2"],
+        "significance": "high|moderate|low",
+        "primary_cause_category": "earnings|news|market|technical",
+        "confidence": 0.8,
+        "reasoning": "Brief explanation of your analysis"
+    }},
+    "sentiment": {{
+        "overall_sentiment": "positive|negative|neutral",
+        "sentiment_score": 0.5,
+        "news_contribution_percent": 30,
+        "key_themes": ["theme1", "theme2"],
+        "market_impact_assessment": "detailed explanation",
+        "confidence": 0.8
+    }},
+    "master_inference": {{
+        "executive_summary": "Brief 1-2 sentence explanation",
+        "primary_cause": "Main driver category",
+        "detailed_reasoning": "Comprehensive explanation of why this price movement occurred",
+        "key_catalysts": ["catalyst1", "catalyst2"],
+        "confidence_score": 0.8,
+        "cause_confidence": 0.8,
+        "movement_sustainability": "moderate",
+        "investment_thesis": "Investment implication"
+    }}
+}}
+
+IMPORTANT: Response must be valid JSON only. No markdown, no explanatory text, just the JSON object."""
+
+_INVESTIGATION_DECISION_PROMPT = """As an AI investment analyst, make autonomous decisions about what to investigate next for {symbol}.
+
+CURRENT FINDINGS:
+{findings}
+
+Based on these findings, decide what investigation paths to pursue. Respond in JSON:
+{{
+    "next_investigations": ["investigation1", "investigation2"],
+    "priority_level": "high|medium|low",
+    "reasoning": "Why these investigations are needed",
+    "expected_insights": ["insight1", "insight2"],
+    "investigation_depth": "comprehensive|targeted|basic"
+}}"""
+
+def _cached_text_block(text: str) -> Dict[str, Any]:
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+# Expected reply shape per analysis; missing keys take these defaults
+_PRICE_MOVEMENT_SHAPE = {
+    "investigation_hypotheses": [],
+    "parallel_investigations": [],
+    "significance": "moderate",
+    "primary_cause_category": "market",
+    "confidence": 0.6,
+    "reasoning": ""
+}
+
+_NEWS_SENTIMENT_SHAPE = {
+    "overall_sentiment": "neutral",
+    "sentiment_score": 0.5,
+    "news_contribution_percent": 30,
+    "key_themes": [],
+    "market_impact_assessment": "",
+    "confidence": 0.5
+}
+
+_EARNINGS_IMPACT_SHAPE = {
+    "earnings_explanation": "",
+    "surprise_factor": 0.5,
+    "earnings_contribution_percent": 40,
+    "forward_guidance_impact": "neutral",
+    "market_reaction_appropriateness": "appropriate",
+    "confidence": 0.5
+}
+
+_INVESTIGATION_DECISION_SHAPE = {
+    "next_investigations": [],
+    "priority_level": "medium",
+    "reasoning": "",
+    "expected_insights": [],
+    "investigation_depth": "targeted"
+}
+
+# Only the numeric fields: missing text keys are left out so callers' readable defaults apply
+_MASTER_INFERENCE_SHAPE = {
+    "confidence_score": 0.6,
+    "cause_confidence": 0.6
+}
+
+# Shape of each section of the combined investigation reply
+_FULL_INVESTIGATION_SHAPES = {
+    "price_analysis": _PRICE_MOVEMENT_SHAPE,
+    "sentiment": _NEWS_SENTIMENT_SHAPE,
+    "master_inference": _MASTER_INFERENCE_SHAPE
+}
+
+_PRICE_MOVEMENT_FALLBACK = {
+    **_PRICE_MOVEMENT_SHAPE,
+    "investigation_hypotheses": ["Market dynamics analysis needed"],
+    "parallel_investigations": ["news_analysis", "market_context"],
+    "reasoning": "Claude API unavailable - using fallback analysis",
+    "fallback": True
+}
+
+_NEWS_SENTIMENT_FALLBACK = {
+    **_NEWS_SENTIMENT_SHAPE,
+    "key_themes": ["market activity"],
+    "market_impact_assessment": "Limited analysis available",
+    "fallback": True
+}
+
+_EARNINGS_IMPACT_FALLBACK = {
+    **_EARNINGS_IMPACT_SHAPE,
+    "earnings_explanation": "Earnings analysis unavailable",
+    "fallback": True
+}
+
+_INVESTIGATION_DECISION_FALLBACK = {
+    **_INVESTIGATION_DECISION_SHAPE,
+    "next_investigations": ["market_analysis"],
+    "reasoning": "Standard investigation protocol",
+    "expected_insights": ["Market dynamics"],
+    "fallback": True
+}
+
+def _conform(parsed: Dict[str, Any], shape: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill keys missing from a parsed reply and coerce float fields, e.g. "0.8" -> 0.8"""
+    result = {**shape, **parsed}
+    for key, default in shape.items():
+        if isinstance(default, float) and not isinstance(result[key], float):
+            try:
+                result[key] = float(result[key])
+            except (TypeError, ValueError):
+                result[key] = default
+    return result
+
 class ClaudeAIService:
     def __init__(self):
         self.api_key = os.getenv("ANTHROPIC_API_KEY")
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is required")
         
-        self.client = Anthropic(api_key=self.api_key)
+        self.client = AsyncAnthropic(
+            api_key=self.api_key,
+            # One pooled HTTP/2 client multiplexes concurrent Claude calls over a single connection
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+            )
+        )
         self.model = "claude-3-5-sonnet-20241022"  # Latest Claude model
+        
+        # Parsed replies keyed by a hash of model, temperature and prompt
+        self._cache: TTLCache = TTLCache(maxsize=1024, ttl=1800)
+    
+    def _cache_key(self, prompt: Union[str, List[Dict[str, Any]]], temperature: float) -> str:
+        prompt_text = prompt if isinstance(prompt, str) else orjson.dumps(prompt).decode()
+        return hashlib.sha256(f"{self.model}|{temperature}|{prompt_text}".encode()).hexdigest()
+    
+    def _normalized_cache_key(self, method: str, temperature: float, **fields: Any) -> str:
+        """Cache key built from normalized inputs, so near-identical prompts share a reply"""
+        return self._cache_key(f"{method}|{orjson.dumps(fields, option=orjson.OPT_SORT_KEYS).decode()}", temperature)
+    
+    async def _call_claude(self, prompt: Union[str, List[Dict[str, Any]]], max_tokens: int,
+                           temperature: float, cache_key: Optional[str] = None,
+                           shape: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Send a prompt (text or content blocks) to Claude and parse its JSON reply, reusing the reply to an identical prompt"""
+        key = cache_key or self._cache_key(prompt, temperature)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        text = await self._stream_json_text(prompt, max_tokens, temperature)
+        result = self._parse_claude_json(text)
+        if shape is not None:
+            result = _conform(result, shape)
+        self._cache[key] = result
+        return result
+    
+    async def _stream_json_text(self, prompt: Union[str, List[Dict[str, Any]]], max_tokens: int,
+                                temperature: float, on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Stream Claude's reply and stop reading as soon as the first JSON object is complete"""
+        chunks = []
+        scanner = _JsonObjectScanner()
+        async with CLAUDE_SEM:
+            async with self.client.messages.stream(
+                model=self.model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=[{"role": "user", "content": prompt}],
+                extra_headers=None if isinstance(prompt, str) else _PROMPT_CACHING_HEADERS
+            ) as stream:
+                async for text in stream.text_stream:
+                    chunks.append(text)
+                    if on_text is not None:
+                        on_text(text)
+                    if scanner.feed(text) != -1:
+                        # Leaving the context closes the connection and stops generation
+                        break
+        return "".join(chunks)
     
     def _parse_claude_json(self, content: str) -> Dict[str, Any]:
         """Robust JSON parsing for Claude responses"""
         try:
             # First, try direct parsing
-            return json.loads(content)
-        except json.JSONDecodeError:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
             pass
         
         try:
-            # Clean control characters except newlines and tabs
-            cleaned_content = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', content)
+            cleaned_content = _CTRL_RE.sub('', content)
             
             # Try to extract JSON from markdown code blocks
-            json_patterns = [
-                r'```json\s*(\{.*?\})\s*```',
-                r'```\s*(\{.*?\})\s*```',
-                r'(\{[^{}]*\{[^{}]*\}[^{}]*\})',  # Nested JSON
-                r'(\{[^{}]+\})'  # Simple JSON
-            ]
-            
-            for pattern in json_patterns:
-                matches = re.findall(pattern, cleaned_content, re.DOTALL)
-                if matches:
-                    json_str = matches[0].strip()
+            for pattern in _JSON_PATTERNS:
+                match = pattern.search(cleaned_content)
+                if match:
+                    json_str = match.group(1).strip()
                     try:
-                        return json.loads(json_str)
-                    except json.JSONDecodeError:
+                        return orjson.loads(json_str)
+                    except orjson.JSONDecodeError:
                         continue
             
+            # Take the first balanced JSON object, e.g. when Claude adds prose around it
+            start = cleaned_content.find('{')
+            while start != -1:
+                json_str = _extract_json_span(cleaned_content, start)
+                if json_str is None:
+                    break
+                try:
+                    return orjson.loads(json_str)
+                except orjson.JSONDecodeError:
+                    start = cleaned_content.find('{', start + 1)
+            
             # If all else fails, try to manually extract key-value pairs
             result = {}
-            key_patterns = [
-                r'"executive_summary":\s*"([^"]*)"',
-                r'"primary_cause":\s*"([^"]*)"',
-                r'"detailed_reasoning":\s*"([^"]*)"',
-                r'"confidence_score":\s*([0-9.]+)',
-                r'"cause_confidence":\s*([0-9.]+)'
-            ]
-            
-            for i, pattern in enumerate(key_patterns):
-                match = re.search(pattern, cleaned_content)
+            for key, pattern in _KEY_PATTERNS:
+                match = pattern.search(cleaned_content)
                 if match:
-                    key = ["executive_summary", "primary_cause", "detailed_reasoning", "confidence_score", "cause_confidence"][i]
                     value = match.group(1)
                     if key in ["confidence_score", "cause_confidence"]:
                         result[key] = float(value)
@@ -71,8 +433,8 @@ class ClaudeAIService:
             raise ValueError("Could not parse JSON from Claude response")
             
         except Exception as e:
-            print(f"JSON parsing error: {e}")
-            print(f"Content preview: {content[:200]}...")
+            logger.warning("JSON parsing error: %s", e)
+            logger.debug("Content preview: %s...", content[:200])
             raise
     
     async def analyze_price_movement(self, stock_data: Dict[str, Any], symbol: str) -> Dict[str, Any]:
@@ -82,234 +444,205 @@ class ClaudeAIService:
         current_price = stock_data.get("current_price", 0)
         volume = stock_data.get("volume", 0)
         
-        prompt = f"""You are a professional stock market analyst. Analyze the following stock data and provide intelligent investigation strategy:
-
-STOCK: {symbol}
-PRICE CHANGE: {price_change:.2f}%
-CURRENT PRICE: ${current_price:.2f}
-VOLUME: {volume:,}
-
-Based on this price movement, determine:
-1. What investigation hypotheses should be explored?
-2. What parallel investigation threads should be spawned?
-3. How significant is this price movement?
-4. What's the most likely cause category?
-
-Respond in JSON format:
-{{
-    "investigation_hypotheses": ["hypothesis1", "hypothesis2", ...],
-    "parallel_investigations": ["thread1", "thread2", ...],
-    "significance": "high|moderate|low",
-    "primary_cause_category": "earnings|news|market|technical",
-    "confidence": 0.8,
-    "reasoning": "Brief explanation of your analysis"
-}}"""
+        prompt = _PRICE_MOVEMENT_PROMPT.format(
+            symbol=symbol, price_change=price_change, current_price=current_price, volume=volume
+        )
 
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=1000,
-                temperature=0.3,
-                messages=[{"role": "user", "content": prompt}]
+            # Moves that differ only in the second decimal or in volume noise reuse one reply
+            cache_key = self._normalized_cache_key(
+                "analyze_price_movement", 0.3,
+                symbol=symbol,
+                price_change=round(price_change, 1),
+                current_price=round(current_price),
+                volume=float(f"{volume:.2g}")
             )
-            
-            # Parse Claude's response using robust JSON parser
-            content = response.content[0].text
-            return self._parse_claude_json(content)
+            return await self._call_claude(prompt, max_tokens=1000, temperature=0.3, cache_key=cache_key,
+                                           shape=_PRICE_MOVEMENT_SHAPE)
             
         except Exception as e:
-            print(f"Error in Claude price movement analysis: {e}")
+            logger.warning("Error in Claude price movement analysis: %s", e)
             # Fallback response
-            return {
-                "investigation_hypotheses": ["Market dynamics analysis needed"],
-                "parallel_investigations": ["news_analysis", "market_context"],
-                "significance": "moderate",
-                "primary_cause_category": "market",
-                "confidence": 0.6,
-                "reasoning": "Claude API unavailable - using fallback analysis"
-            }
+            return dict(_PRICE_MOVEMENT_FALLBACK)
     
     async def analyze_news_sentiment(self, symbol: str, news_articles: List[Dict], price_change: float) -> Dict[str, Any]:
         """Use Claude to analyze news sentiment and its impact on stock price"""
         
         headlines = [article.get("headline", "") for article in news_articles[:5]]  # Limit to 5 headlines
         
-        prompt = f"""As a financial news analyst, analyze how these news headlines relate to {symbol}'s {price_change:.2f}% price movement:
-
-HEADLINES:
-{chr(10).join([f"- {headline}" for headline in headlines])}
-
-PRICE MOVEMENT: {price_change:.2f}%
-
-Provide analysis in JSON format:
-{{
-    "overall_sentiment": "positive|negative|neutral",
-    "sentiment_score": 0.0-1.0,
-    "news_contribution_percent": 0-100,
-    "key_themes": ["theme1", "theme2"],
-    "market_impact_assessment": "detailed explanation",
-    "confidence": 0.0-1.0
-}}"""
+        prompt = [
+            _cached_text_block(_NEWS_SENTIMENT_INSTRUCTIONS),
+            {"type": "text", "text": _NEWS_SENTIMENT_DATA.format(
+                symbol=symbol,
+                headlines="\n".join("- " + headline for headline in headlines),
+                price_change=price_change
+            )}
+        ]
 
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=800,
-                temperature=0.2,
-                messages=[{"role": "user", "content": prompt}]
+            # Headline order and sub-0.1% price noise do not change the reply
+            cache_key = self._normalized_cache_key(
+                "analyze_news_sentiment", 0.2,
+                symbol=symbol,
+                headlines=sorted(set(headlines)),
+                price_change=round(price_change, 1)
             )
-            
-            content = response.content[0].text
-            return self._parse_claude_json(content)
+            return await self._call_claude(prompt, max_tokens=800, temperature=0.2, cache_key=cache_key,
+                                           shape=_NEWS_SENTIMENT_SHAPE)
             
         except Exception as e:
-            print(f"Error in Claude news analysis: {e}")
-            return {
-                "overall_sentiment": "neutral",
-                "sentiment_score": 0.5,
-                "news_contribution_percent": 30,
-                "key_themes": ["market activity"],
-                "market_impact_assessment": "Limited analysis available",
-                "confidence": 0.5
-            }
+            logger.warning("Error in Claude news analysis: %s", e)
+            return dict(_NEWS_SENTIMENT_FALLBACK)
     
     async def analyze_earnings_impact(self, symbol: str, earnings_data: Dict[str, Any], price_change: float) -> Dict[str, Any]:
         """Use Claude to analyze earnings data and its impact on stock price"""
         
-        prompt = f"""As a financial analyst, analyze how {symbol}'s earnings performance relates to its {price_change:.2f}% price movement:
-
-EARNINGS DATA:
-- EPS: ${earnings_data.get('last_quarter_eps', 0):.2f} (Expected: ${earnings_data.get('expected_eps', 0):.2f})
-- Revenue Growth: {earnings_data.get('revenue_growth', 0):.1f}%
-- Beat Expectations: {earnings_data.get('beat_estimate', False)}
-- Guidance Updated: {earnings_data.get('guidance_updated', False)}
-
-PRICE MOVEMENT: {price_change:.2f}%
-
-Analyze in JSON format:
-{{
-    "earnings_explanation": "detailed analysis of earnings impact",
-    "surprise_factor": 0.0-1.0,
-    "earnings_contribution_percent": 0-100,
-    "forward_guidance_impact": "positive|negative|neutral",
-    "market_reaction_appropriateness": "overreaction|appropriate|underreaction",
-    "confidence": 0.0-1.0
-}}"""
+        prompt = _EARNINGS_IMPACT_PROMPT.format(
+            symbol=symbol,
+            price_change=price_change,
+            eps=earnings_data.get('last_quarter_eps', 0),
+            expected_eps=earnings_data.get('expected_eps', 0),
+            revenue_growth=earnings_data.get('revenue_growth', 0),
+            beat_estimate=earnings_data.get('beat_estimate', False),
+            guidance_updated=earnings_data.get('guidance_updated', False)
+        )
 
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=800,
-                temperature=0.2,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            content = response.content[0].text
-            return self._parse_claude_json(content)
+            return await self._call_claude(prompt, max_tokens=800, temperature=0.2, shape=_EARNINGS_IMPACT_SHAPE)
             
         except Exception as e:
-            print(f"Error in Claude earnings analysis: {e}")
-            return {
-                "earnings_explanation": "Earnings analysis unavailable",
-                "surprise_factor": 0.5,
-                "earnings_contribution_percent": 40,
-                "forward_guidance_impact": "neutral",
-                "market_reaction_appropriateness": "appropriate",
-                "confidence": 0.5
-            }
-    
-    async def generate_master_inference(self, symbol: str, all_findings: List[str], 
-                                      price_data: Dict[str, Any], 
-                                      investigation_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Use Claude to generate comprehensive master inference explaining WHY price moved"""
-        
+            logger.warning("Error in Claude earnings analysis: %s", e)
+            return dict(_EARNINGS_IMPACT_FALLBACK)
+
+    async def run_all_analyses(self, symbol: str, stock_data: Dict[str, Any], news_articles: List[Dict],
+                               earnings_data: Dict[str, Any], price_change: float) -> List[Any]:
+        """Run the price, news and earnings analyses concurrently.
+
+        Returns the three results in that order; a slot holds the exception if its analysis raised.
+        """
+        return await asyncio.gather(
+            self.analyze_price_movement(stock_data, symbol),
+            self.analyze_news_sentiment(symbol, news_articles, price_change),
+            self.analyze_earnings_impact(symbol, earnings_data, price_change),
+            return_exceptions=True
+        )
+
+    def _master_inference_prompt(self, symbol: str, all_findings: List[str],
+                                 price_data: Dict[str, Any],
+                                 investigation_data: Dict[str, Any]) -> List[Dict[str, Any]]:
         price_change = price_data.get("price_change_percent", 0)
         start_price = price_data.get("start_price", 0)
         end_price = price_data.get("end_price", 0)
         
-        findings_text = "\n".join([f"- {finding}" for finding in all_findings])
+        findings_text = "\n".join("- " + finding for finding in all_findings)
+        data_text = (orjson.dumps(investigation_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+                     if investigation_data else "Limited data available")
         
-        prompt = f"""Analyze why {symbol} moved {price_change:.2f}% from ${start_price:.2f} to ${end_price:.2f}.
+        # Stable instructions first so they form the cached prefix; per-call data follows
+        return [
+            _cached_text_block(_MASTER_INFERENCE_INSTRUCTIONS),
+            {"type": "text", "text": _MASTER_INFERENCE_DATA.format(findings=findings_text, data=data_text)},
+            {"type": "text", "text": _MASTER_INFERENCE_QUESTION.format(
+                symbol=symbol, price_change=price_change, start_price=start_price, end_price=end_price
+            )}
+        ]
 
-INVESTIGATION FINDINGS:
-{findings_text}
-
-DATA: {json.dumps(investigation_data, indent=2) if investigation_data else "Limited data available"}
-
-Respond with ONLY valid JSON in this exact format:
-{{
-    "executive_summary": "Brief 1-2 sentence explanation",
-    "primary_cause": "Main driver category", 
-    "detailed_reasoning": "Comprehensive explanation of why this price movement occurred",
-    "key_catalysts": ["catalyst1", "catalyst2"],
-    "confidence_score": 0.8,
-    "cause_confidence": 0.8,
-    "movement_sustainability": "moderate",
-    "investment_thesis": "Investment implication"
-}}
+    def _master_inference_fallback(self, symbol: str, price_data: Dict[str, Any]) -> Dict[str, Any]:
+        price_change = price_data.get("price_change_percent", 0)
+        return {
+            "executive_summary": f"{symbol} moved {price_change:.2f}% due to market dynamics requiring further analysis",
+            "primary_cause": "Market Analysis Required",
+            "detailed_reasoning": "Comprehensive analysis unavailable - Claude API error occurred",
+            "key_catalysts": ["Market activity"],
+            "confidence_score": 0.6,
+            "cause_confidence": 0.6,
+            "movement_sustainability": "moderate",
+            "investment_thesis": "Monitor for additional data",
+            "fallback": True
+        }
 
-IMPORTANT: Response must be valid JSON only. No markdown, no explanatory text, just the JSON object."""
+    async def generate_master_inference(self, symbol: str, all_findings: List[str], 
+                                      price_data: Dict[str, Any], 
+                                      investigation_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Use Claude to generate comprehensive master inference explaining WHY price moved"""
+        
+        prompt = self._master_inference_prompt(symbol, all_findings, price_data, investigation_data)
 
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=1500,
-                temperature=0.2,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            return await self._call_claude(prompt, max_tokens=1500, temperature=0.2,
+                                           shape=_MASTER_INFERENCE_SHAPE)
             
-            content = response.content[0].text
-            return self._parse_claude_json(content)
+        except Exception as e:
+            logger.warning("Error in Claude master inference: %s", e)
+            return self._master_inference_fallback(symbol, price_data)
+    
+    async def stream_master_inference(self, symbol: str, all_findings: List[str],
+                                      price_data: Dict[str, Any],
+                                      investigation_data: Dict[str, Any],
+                                      on_text: Callable[[str], None]) -> Dict[str, Any]:
+        """Like generate_master_inference, but passes each text chunk to on_text as Claude streams it"""
+        
+        prompt = self._master_inference_prompt(symbol, all_findings, price_data, investigation_data)
+        
+        try:
+            text = await self._stream_json_text(prompt, max_tokens=1500, temperature=0.2, on_text=on_text)
+            return _conform(self._parse_claude_json(text), _MASTER_INFERENCE_SHAPE)
             
         except Exception as e:
-            print(f"Error in Claude master inference: {e}")
-            return {
-                "executive_summary": f"{symbol} moved {price_change:.2f}% due to market dynamics requiring further analysis",
-                "primary_cause": "Market Analysis Required",
-                "detailed_reasoning": "Comprehensive analysis unavailable - Claude API error occurred",
-                "key_catalysts": ["Market activity"],
-                "confidence_score": 0.6,
-                "cause_confidence": 0.6,
-                "movement_sustainability": "moderate",
-                "investment_thesis": "Monitor for additional data"
-            }
+            logger.warning("Error in Claude master inference stream: %s", e)
+            return self._master_inference_fallback(symbol, price_data)
     
+    async def analyze_full_investigation(self, symbol: str, stock_data: Dict[str, Any],
+                                         news_articles: List[Dict]) -> Dict[str, Any]:
+        """Use a single Claude request for price analysis, news sentiment and master inference"""
+
+        price_change = stock_data.get("price_change_percent", 0)
+        start_price = stock_data.get("start_price", 0)
+        current_price = stock_data.get("current_price", 0)
+        volume = stock_data.get("volume", 0)
+
+        headlines = [article.get("headline", "") for article in news_articles[:5]]
+
+        prompt = _FULL_INVESTIGATION_PROMPT.format(
+            symbol=symbol,
+            price_change=price_change,
+            start_price=start_price,
+            current_price=current_price,
+            volume=volume,
+            headlines="\n".join("- " + headline for headline in headlines)
+        )
+
+        try:
+            result = await self._call_claude(prompt, max_tokens=3000, temperature=0.2)
+            for section, shape in _FULL_INVESTIGATION_SHAPES.items():
+                if not isinstance(result.get(section), dict):
+                    self._cache.pop(self._cache_key(prompt, 0.2), None)
+                    raise ValueError(f"Combined response missing '{section}'")
+                # Conformed in place, so the cached reply is conformed too
+                result[section] = _conform(result[section], shape)
+            return result
+
+        except Exception as e:
+            logger.warning("Error in Claude combined investigation analysis: %s", e)
+            # Callers fall back to the individual analysis methods
+            return {"fallback": True}
+
     async def generate_investigation_decision(self, current_findings: List[str], symbol: str) -> Dict[str, Any]:
         """Use Claude to make autonomous investigation decisions"""
         
-        findings_text = "\n".join([f"- {finding}" for finding in current_findings])
+        findings_text = "\n".join("- " + finding for finding in current_findings)
         
-        prompt = f"""As an AI investment analyst, make autonomous decisions about what to investigate next for {symbol}.
-
-CURRENT FINDINGS:
-{findings_text}
-
-Based on these findings, decide what investigation paths to pursue. Respond in JSON:
-{{
-    "next_investigations": ["investigation1", "investigation2"],
-    "priority_level": "high|medium|low",
-    "reasoning": "Why these investigations are needed",
-    "expected_insights": ["insight1", "insight2"],
-    "investigation_depth": "comprehensive|targeted|basic"
-}}"""
+        prompt = _INVESTIGATION_DECISION_PROMPT.format(symbol=symbol, findings=findings_text)
 
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=600,
-                temperature=0.3,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            content = response.content[0].text
-            return self._parse_claude_json(content)
+            return await self._call_claude(prompt, max_tokens=600, temperature=0.3,
+                                           shape=_INVESTIGATION_DECISION_SHAPE)
             
         except Exception as e:
-            print(f"Error in Claude investigation decision: {e}")
-            return {
-                "next_investigations": ["market_analysis"],
-                "priority_level": "medium",
-                "reasoning": "Standard investigation protocol",
-                "expected_insights": ["Market dynamics"],
-                "investigation_depth": "targeted"
-            }
\ No newline at end of file
+            logger.warning("Error in Claude investigation decision: %s", e)
+            return dict(_INVESTIGATION_DECISION_FALLBACK)
+
+@lru_cache(maxsize=1)
+def get_claude_service() -> ClaudeAIService:
+    """Process-wide ClaudeAIService so every agent shares one connection pool"""
+    return ClaudeAIService()
@@ -0,0 +1,36 @@
+"""
+File-backed JSON cache that survives process restarts
+"""
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import orjson
+
+class FileCache:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, namespace: str, key: str) -> Path:
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return self.root / namespace / f"{digest}.json"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the cached value, or None if it is missing, unreadable or expired"""
+        try:
+            entry = orjson.loads(self._path(namespace, key).read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        if time.time() - entry.get("fetched_at", 0) >= entry.get("ttl", 0):
+            return None
+        return entry.get("value")
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float):
+        path = self._path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so readers never see a partial entry
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(orjson.dumps({"fetched_at": time.time(), "ttl": ttl, "value": value}))
+        tmp_path.replace(path)
@@ -0,0 +1,18 @@
+"""
+Shared timestamp helpers; every API and WebSocket timestamp is timezone-aware UTC
+"""
+import time
+from datetime import datetime, timezone
+
+# ISO timestamp reused for up to half a second instead of formatting one per message
+_NOW = {"s": "", "t": 0.0}
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def iso_now() -> str:
+    t = time.time()
+    if t - _NOW["t"] > 0.5:
+        _NOW["s"] = datetime.fromtimestamp(t, tz=timezone.utc).isoformat()
+        _NOW["t"] = t
+    return _NOW["s"]
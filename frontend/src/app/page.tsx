@@ -81,25 +81,37 @@ export default function Home() {
       setCurrentWebSocket(ws);
       
       ws.onmessage = (event) => {
-        const update = JSON.parse(event.data);
-        console.log('Received update:', update);
-
-        if (update.type === 'node_update') {
-          // Handle actual investigation nodes
-          setNodes(prev => [...prev, update.node]);
-        } else if (update.type === 'investigation_complete') {
-          console.log('Investigation completed');
-          setIsLoading(false);
-          ws.close();
-          if (timeoutRef.current) {
-            clearTimeout(timeoutRef.current);
-          }
-        } else if (update.type === 'error') {
-          console.error('Investigation error:', update);
-          setIsLoading(false);
-          ws.close();
-          if (timeoutRef.current) {
-            clearTimeout(timeoutRef.current);
+        // The server may merge several updates into one array frame
+        const payload = JSON.parse(event.data);
+        const updates = Array.isArray(payload) ? payload : [payload];
+        for (const update of updates) {
+          console.log('Received update:', update);
+
+          if (update.type === 'node_update') {
+            // Handle actual investigation nodes
+            setNodes(prev => [...prev, update.node]);
+          } else if (update.type === 'node_updated') {
+            // A node finished after streaming partial output
+            setNodes(prev => prev.map(node => node.id === update.node.id ? update.node : node));
+          } else if (update.type === 'node_update_partial') {
+            // Append streamed text to the in-progress node
+            setNodes(prev => prev.map(node => node.id === update.id
+              ? { ...node, data: { ...node.data, streamed_text: ((node.data as any).streamed_text || '') + update.delta } }
+              : node));
+          } else if (update.type === 'investigation_complete') {
+            console.log('Investigation completed');
+            setIsLoading(false);
+            ws.close();
+            if (timeoutRef.current) {
+              clearTimeout(timeoutRef.current);
+            }
+          } else if (update.type === 'error') {
+            console.error('Investigation error:', update);
+            setIsLoading(false);
+            ws.close();
+            if (timeoutRef.current) {
+              clearTimeout(timeoutRef.current);
+            }
           }
         }
       };      ws.onerror = (error) => {
@@ -53,6 +53,24 @@ export default function NodeVisualization({ nodes, isLoading }: NodeVisualizatio
     );
   };
 
+  // The master inference streams raw JSON; pull out the readable fields written so far
+  const getStreamedPreview = (text: string) => {
+    return ['executive_summary', 'detailed_reasoning']
+      .map(field => {
+        const match = text.match(new RegExp(`"${field}"\\s*:\\s*"((?:[^"\\\\]|\\\\.)*)`));
+        if (!match) return '';
+        // Drop an escape sequence cut off mid-stream before decoding the rest
+        const value = match[1].replace(/\\(u[0-9a-fA-F]{0,3})?$/, '');
+        try {
+          return JSON.parse(`"${value}"`) as string;
+        } catch {
+          return value;
+        }
+      })
+      .filter(Boolean)
+      .join('\n\n');
+  };
+
   const getNodeColor = (type: string) => {
     const colors = {
       data_fetch: 'border-blue-500 bg-blue-900/20',
@@ -173,6 +191,17 @@ export default function NodeVisualization({ nodes, isLoading }: NodeVisualizatio
                     </div>
                     {isLargeInferenceNode(node) ? (
                       <div className="space-y-2">
+                        {/* Live text while Claude is still streaming */}
+                        {node.status === 'in_progress' && typeof (node.data as any)?.streamed_text === 'string' && (
+                          <div>
+                            <span className="text-gray-400 text-xs font-medium">Streaming Analysis:</span>
+                            <p className="text-white text-xs mt-1 leading-relaxed whitespace-pre-wrap">
+                              {getStreamedPreview((node.data as any).streamed_text) || 'Waiting for Claude...'}
+                              <span className="animate-pulse">▍</span>
+                            </p>
+                          </div>
+                        )}
+                        
                         {/* Executive Summary */}
                         {(node.data as any)?.executive_summary && (
                           <div>
@@ -214,7 +243,7 @@ export default function NodeVisualization({ nodes, isLoading }: NodeVisualizatio
                         
                         {/* Other important fields */}
                         {Object.entries(node.data)
-                          .filter(([key]) => !['executive_summary', 'key_findings', 'detailed_reasoning'].includes(key))
+                          .filter(([key]) => !['executive_summary', 'key_findings', 'detailed_reasoning', 'streamed_text'].includes(key))
                           .slice(0, 2)
                           .map(([key, value]) => (
                             <div key={key} className="flex justify-between items-start">